@@ -11,19 +11,25 @@ Other goodness kept:
 - 1,000-char preview + rendered markdown in an expander
 - Per-file Download (.md), optional .txt export, optional Download-All ZIP
 - Large-file warning + chunked save with progress bar
-- SHA-256 dedupe & cache
+- BLAKE3 content dedupe + conversion cache shared across sessions
 """
 
-import io
 import os
 import re
+import queue
 import zipfile
-import hashlib
+import shutil
 import tempfile
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from functools import lru_cache
 from pathlib import Path
-from typing import Dict, Tuple, Optional
+from typing import Dict, Tuple, Optional, Union
 
+import blake3
+import pandas as pd
 import streamlit as st
 from markitdown import MarkItDown
 
@@ -48,9 +54,16 @@ ALLOWED_TYPES = [
 ACCEPTED_EXTS = tuple("." + x for x in ALLOWED_TYPES)
 
 CHUNK_SIZE = 4 * 1024 * 1024  # 4 MB
+PROGRESS_EVERY = 16 * 1024 * 1024  # redraw the save progress bar every 16 MB
 WARN_MB = 50                  # warn users beyond this
 HARD_CAP_MB = 200             # block beyond this
 PREVIEW_CHARS = 1000
+MAX_WORKERS = 8               # parallel conversions per run
+MAX_RESULTS = 20              # default cap on results kept per session
+CONVERT_CACHE_ENTRIES = 64    # conversions kept in memory, shared by all sessions
+CONVERT_CACHE_TTL = 60 * 60   # seconds a cached conversion is kept
+ZIP_LEVEL = 1                 # fastest deflate; Markdown still shrinks well
+ZIP_STORE_UNDER = 8 * 1024    # entries smaller than this are stored uncompressed
 
 st.set_page_config(
     page_title="Docs to Markdown Converter",
@@ -65,51 +78,120 @@ st.caption("Drag & drop your files. We’ll convert to Markdown, show a preview,
 # Session State
 # --------------------------
 if "results" not in st.session_state:
-    # results: dict[sha256] -> {
+    # results: dict[blake3] -> {
     #   "name": str,
+    #   "base": str,   # sanitized stem, used for bundle entry names
     #   "md": str,
-    #   "txt": Optional[str],
+    #   "md_utf8": bytes,   # encoded once; reruns reuse it for downloads
+    #   "txt_utf8": Optional[bytes],   # encoded once, only when .txt export is on
     #   "ts": str,
     #   "original_bytes": int,
-    #   "txt_bytes": Optional[int]
+    #   "txt_bytes": Optional[int]   # None until .txt export or a size comparison needs it
     # }
-    st.session_state.results = {}
+    # OrderedDict in least → most recently used order, capped at max_results
+    # (files still in the uploader are never evicted)
+    st.session_state.results = OrderedDict()
 
 # --------------------------
 # Utilities
 # --------------------------
+# Every ASCII byte outside [A-Za-z0-9._-]; non-ASCII is dropped by the encode
+_SANITIZE_DELETE = bytes(i for i in range(128) if not (chr(i).isalnum() or chr(i) in "._-"))
+
 def sanitize_filename(name: str) -> str:
     name = name.strip().replace(" ", "_")
-    return re.sub(r"[^A-Za-z0-9._-]", "", name) or "file"
+    raw = name.encode("ascii", "ignore").translate(None, _SANITIZE_DELETE)
+    return raw.decode("ascii") or "file"
+
+def file_stem(name: str) -> str:
+    # Like Path(name).stem for plain upload names ("a.tar.gz" -> "a.tar", ".env" -> ".env")
+    return name.rpartition(".")[0] or name
+
+@lru_cache(maxsize=1)
+def _stamp_for(second: int) -> str:
+    return datetime.fromtimestamp(second).strftime("%Y%m%d-%H%M%S")
+
+def timestamp() -> str:
+    """Local time as YYYYmmdd-HHMMSS; formatted at most once per second."""
+    return _stamp_for(int(time.time()))
 
 def build_output_name(input_name: str, ext: str = ".md") -> str:
-    base = sanitize_filename(Path(input_name).stem or "converted")
-    stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
-    return f"{base}__{stamp}{ext}"
+    base = sanitize_filename(file_stem(input_name) or "converted")
+    return f"{base}__{timestamp()}{ext}"
+
+# Light MD → text patterns, compiled once
+_RE_CODE = re.compile(r"`{1,3}[^`]*`{1,3}")
+_RE_LEAD = re.compile(r"^\s{0,3}(#+|\*|-|\+|>)\s*", re.MULTILINE)
+_RE_IMG = re.compile(r"!\[([^\]]*)\]\([^)]+\)")
+_RE_LINK = re.compile(r"\[([^\]]+)\]\([^)]+\)")
+_RE_PUNCT = re.compile(r"[*_>#~`]")
+_MD_CHARS = "`*_>#~["   # anything the passes above could act on, bar -/+ list markers
+_RE_LIST = re.compile(r"^\s{0,3}[-+]", re.MULTILINE)
+# Only runs that actually change: two+ blanks, or any tab (single spaces stay as-is)
+_RE_WS = re.compile(r" [ \t]+|\t[ \t]*")
 
 def strip_markdown(md: str) -> str:
+    # Plain text (e.g. .txt/.csv output) only needs the whitespace pass
+    if not any(c in md for c in _MD_CHARS) and not _RE_LIST.search(md):
+        return _RE_WS.sub(" ", md).strip()
     # Light MD → text
-    text = re.sub(r"`{1,3}[^`]*`{1,3}", "", md)
-    text = re.sub(r"^\s{0,3}(#+|\*|-|\+|>)\s*", "", text, flags=re.MULTILINE)
-    text = re.sub(r"!\[([^\]]*)\]\([^)]+\)", r"\1", text)         # images alt text
-    text = re.sub(r"\[([^\]]+)\]\([^)]+\)", r"\1", text)          # link text
-    text = re.sub(r"[*_>#~`]", "", text)
-    text = re.sub(r"[ \t]+", " ", text)
+    text = _RE_CODE.sub("", md)
+    text = _RE_LEAD.sub("", text)
+    text = _RE_IMG.sub(r"\1", text)         # images alt text
+    text = _RE_LINK.sub(r"\1", text)        # link text
+    text = _RE_PUNCT.sub("", text)
+    text = _RE_WS.sub(" ", text)
     return text.strip()
 
 def is_supported(filename: str) -> bool:
     return Path(filename).suffix.lower() in ACCEPTED_EXTS
 
+def utf8_len(text: str) -> int:
+    """UTF-8 byte length without materialising the whole encoding."""
+    if text.isascii():
+        return len(text)
+    step = 1 << 16
+    return sum(len(text[i:i + step].encode("utf-8")) for i in range(0, len(text), step))
+
 def human_mb(num_bytes: int) -> float:
     return num_bytes / (1024 * 1024) if num_bytes is not None else 0.0
 
-def sha256_stream_and_save(uploaded_file, suffix: str) -> Tuple[str, str, int]:
-    """Stream an UploadedFile to temp while hashing & tracking size."""
+def full_digest(path: str) -> str:
+    """Multithreaded BLAKE3 of a file on disk."""
+    h = blake3.blake3(max_threads=blake3.blake3.AUTO)
+    h.update_mmap(path)
+    return h.hexdigest()
+
+class SaveSink:
+    """Write target for copyfileobj: counts bytes, redraws progress, enforces the cap."""
+
+    def __init__(self, fdst, total_size: Optional[int], progress):
+        self.fdst = fdst
+        self.total_size = total_size
+        self.progress = progress
+        self.written = 0
+        self.next_redraw = PROGRESS_EVERY
+
+    def write(self, data) -> int:
+        n = self.fdst.write(data)
+        self.written += n
+        if human_mb(self.written) > HARD_CAP_MB:
+            raise ValueError(f"File exceeds hard size cap of {HARD_CAP_MB} MB.")
+        if self.total_size and self.written >= self.next_redraw:
+            self.progress.progress(min(self.written / self.total_size, 1.0), text="Saving upload…")
+            self.next_redraw = self.written + PROGRESS_EVERY
+        return n
+
+# Dedupe hashes the full content on purpose: a hit serves a stored conversion,
+# and a sampled fingerprint (head/middle/tail windows) can't tell apart
+# same-size files edited elsewhere. Earlier uploads' bytes are gone once
+# converted, so a "full hash only on collision" tier has nothing to compare.
+def stream_and_save(uploaded_file, suffix: str) -> Tuple[str, str, int]:
+    """Stream an UploadedFile to temp, then BLAKE3-hash the saved copy."""
     total_size = getattr(uploaded_file, "size", None)
     if total_size and human_mb(total_size) > HARD_CAP_MB:
         raise ValueError(f"File exceeds hard size cap of {HARD_CAP_MB} MB.")
 
-    h = hashlib.sha256()
     tmp = tempfile.NamedTemporaryFile(delete=False, suffix=suffix)
     tmp_path = tmp.name
 
@@ -118,39 +200,95 @@ def sha256_stream_and_save(uploaded_file, suffix: str) -> Tuple[str, str, int]:
     except Exception:
         pass
 
-    bytes_written = 0
     progress = st.progress(0, text="Saving upload…")
-    while True:
-        chunk = uploaded_file.read(CHUNK_SIZE)
-        if not chunk:
-            break
-        tmp.write(chunk)
-        h.update(chunk)
-        bytes_written += len(chunk)
-        if total_size:
-            progress.progress(min(bytes_written / total_size, 1.0), text="Saving upload…")
-        if bytes_written and human_mb(bytes_written) > HARD_CAP_MB:
-            tmp.close()
-            try: os.remove(tmp_path)
-            except OSError: pass
-            progress.empty()
-            raise ValueError(f"File exceeds hard size cap of {HARD_CAP_MB} MB.")
+    sink = SaveSink(tmp, total_size, progress)
+    try:
+        # UploadedFile is an in-memory BytesIO with no fd, so there is no
+        # sendfile-style kernel copy to take here.
+        shutil.copyfileobj(uploaded_file, sink, CHUNK_SIZE)
+    except Exception:
+        tmp.close()
+        try: os.remove(tmp_path)
+        except OSError: pass
+        progress.empty()
+        raise
     tmp.close()
     progress.empty()
-    return tmp_path, h.hexdigest(), bytes_written
-
-@st.cache_data(show_spinner=False)
-def convert_via_markitdown(temp_path: str) -> str:
-    md = MarkItDown()
-    res = md.convert(temp_path)
+    return tmp_path, full_digest(tmp_path), sink.written
+
+@st.cache_resource(show_spinner=False)
+def markitdown_pool() -> "queue.SimpleQueue[MarkItDown]":
+    # Idle MarkItDown instances, shared across reruns and sessions. Setup
+    # (converter registry etc.) happens once per instance, and each worker
+    # checks one out so no instance is used by two threads at once.
+    return queue.SimpleQueue()
+
+@st.cache_data(show_spinner=False, max_entries=CONVERT_CACHE_ENTRIES, ttl=CONVERT_CACHE_TTL)
+def convert_via_markitdown(file_hash: str, _temp_path: str) -> str:
+    # Keyed on content only (Streamlit skips underscore args), so identical
+    # uploads reuse the conversion across sessions. Bounded and memory-only:
+    # users' document text is never written to disk.
+    pool = markitdown_pool()
+    try:
+        md = pool.get_nowait()
+    except queue.Empty:
+        md = MarkItDown()
+    try:
+        res = md.convert(_temp_path)
+    finally:
+        pool.put(md)
     return (res.text_content or "").strip()
 
+def process_one(file_hash: str, temp_path: str, want_txt: bool) -> Dict[str, Optional[str]]:
+    """Convert one saved upload (strip it too when exporting .txt). Worker thread: no st.* calls."""
+    try:
+        md_text, error = convert_via_markitdown(file_hash, temp_path), None
+    except Exception as e:
+        md_text, error = "", str(e)
+    finally:
+        try: os.remove(temp_path)
+        except OSError: pass
+    txt_text = (strip_markdown(md_text) if md_text else "") if want_txt else None
+    return {"md": md_text, "txt": txt_text, "error": error}
+
+def ensure_txt_bytes(entry: dict) -> int:
+    """Plain-text size of a result, stripping its Markdown on first use only."""
+    if entry.get("txt_bytes") is None:
+        entry["txt_bytes"] = utf8_len(strip_markdown(entry["md"])) if entry["md"] else 0
+    return entry["txt_bytes"]
+
+def add_to_zip(zf: zipfile.ZipFile, name: str, data: Union[str, bytes]) -> None:
+    # Deflating tiny entries costs more time than the bytes it saves
+    compress = zipfile.ZIP_STORED if len(data) < ZIP_STORE_UNDER else zipfile.ZIP_DEFLATED
+    zf.writestr(name, data, compress_type=compress)
+
 def pct_smaller(orig_bytes: int, txt_bytes: int) -> Optional[float]:
     if orig_bytes and txt_bytes is not None:
-        ratio = 1.0 - (txt_bytes / max(orig_bytes, 1))
-        return max(min(ratio * 100.0, 100.0), -100.0)
+        pct = (1.0 - txt_bytes / orig_bytes) * 100.0
+        # txt_bytes >= 0 keeps this <= 100; only growth needs flooring
+        return pct if pct > -100.0 else -100.0
     return None
 
+def size_summary(results: Dict[str, dict]) -> pd.DataFrame:
+    """One row per converted file; % smaller uses pct_smaller like the per-file tab.
+
+    The .txt columns are left out until every file's txt_bytes is known, so the
+    table never shows blanks for sizes that simply weren't computed yet.
+    """
+    with_txt = all(item["txt_bytes"] is not None for item in results.values())
+    rows = []
+    for item in results.values():
+        row = {"File": item["name"], "Original (MB)": round(human_mb(item["original_bytes"]), 2)}
+        if with_txt:
+            row["Converted .txt (MB)"] = round(human_mb(item["txt_bytes"]), 2)
+            pct = pct_smaller(item["original_bytes"], item["txt_bytes"])
+            row["% smaller"] = round(pct) if pct is not None else None
+        rows.append(row)
+    columns = ["File", "Original (MB)"]
+    if with_txt:
+        columns += ["Converted .txt (MB)", "% smaller"]
+    return pd.DataFrame(rows, columns=columns)
+
 # --------------------------
 # Sidebar (optional toggles)
 # --------------------------
@@ -158,6 +296,10 @@ with st.sidebar:
     st.subheader("Options")
     also_plain_text = st.checkbox("Also export plain-text (.txt)", value=False)
     allow_zip_all = st.checkbox("Enable 'Download All as ZIP'", value=True)
+    max_results = st.number_input(
+        "Keep at most this many results", min_value=1, max_value=500, value=MAX_RESULTS, step=1,
+        help="Files still in the uploader are always kept; older conversions are dropped first.",
+    )
     st.caption(f"Accepted: {', '.join(ALLOWED_TYPES)}")
     st.caption("Files over 50 MB show a warning; over 200 MB are blocked.")
 
@@ -182,8 +324,13 @@ st.subheader("Results")
 # --------------------------
 # Process each file
 # --------------------------
+# Save + hash runs here (it drives a progress bar); conversions of new
+# content then fan out to worker threads and are rendered in upload order.
+jobs = []       # (upload, container, file_hash, saved_bytes)
+pending = {}    # file_hash -> temp_path, one per distinct new content
 for upload in uploads:
-    with st.container(border=True):
+    box = st.container(border=True)
+    with box:
         st.markdown(f"**File:** {upload.name}")
 
         # Validate extension
@@ -201,43 +348,50 @@ for upload in uploads:
         # Save + hash
         suffix = Path(upload.name).suffix or ""
         try:
-            temp_path, file_hash, saved_bytes = sha256_stream_and_save(upload, suffix)
+            temp_path, file_hash, saved_bytes = stream_and_save(upload, suffix)
         except Exception as e:
             st.error(f"Upload failed: {e}")
             continue
 
-        # Dedupe
-        if file_hash in st.session_state.results:
-            st.info("Already converted in this session. Using cached result.")
-            md_text = st.session_state.results[file_hash]["md"]
-            txt_text = st.session_state.results[file_hash].get("txt")
-            original_bytes = st.session_state.results[file_hash]["original_bytes"]
-            txt_bytes = st.session_state.results[file_hash].get("txt_bytes")
-        else:
-            # Convert
-            try:
-                with st.spinner("Converting…"):
-                    md_text = convert_via_markitdown(temp_path)
-            except Exception as e:
-                st.error(f"Conversion failed: {e}")
-                md_text = ""
-            finally:
-                try: os.remove(temp_path)
-                except OSError: pass
-
-            # Compute TXT (even if we don't export, for size comparison)
-            txt_text = strip_markdown(md_text) if md_text else ""
-            original_bytes = saved_bytes
-            txt_bytes = len(txt_text.encode("utf-8")) if txt_text is not None else 0
-
+    # Dedupe (against the session and within this batch)
+    if file_hash in st.session_state.results or file_hash in pending:
+        try: os.remove(temp_path)
+        except OSError: pass
+    else:
+        pending[file_hash] = temp_path
+    jobs.append((upload, box, file_hash, saved_bytes))
+
+futures = {}
+if pending:
+    executor = ThreadPoolExecutor(max_workers=min(MAX_WORKERS, len(pending)))
+    futures = {h: executor.submit(process_one, h, p, also_plain_text) for h, p in pending.items()}
+    executor.shutdown(wait=False)
+
+for i, (upload, box, file_hash, saved_bytes) in enumerate(jobs):
+    with box:
+        if file_hash in futures and file_hash not in st.session_state.results:
+            with st.spinner("Converting…"):
+                out = futures[file_hash].result()
+            if out["error"]:
+                st.error(f"Conversion failed: {out['error']}")
+            txt_utf8 = out["txt"].encode("utf-8") if out["txt"] is not None else None
             st.session_state.results[file_hash] = {
                 "name": upload.name,
-                "md": md_text,
-                "txt": txt_text if also_plain_text else None,
+                "base": sanitize_filename(file_stem(upload.name)),
+                "md": out["md"],
+                "md_utf8": out["md"].encode("utf-8"),
+                "txt_utf8": txt_utf8,
                 "ts": datetime.now().isoformat(timespec="seconds"),
-                "original_bytes": original_bytes,
-                "txt_bytes": txt_bytes,
+                "original_bytes": saved_bytes,
+                # Without a .txt export this waits for the size tab to ask for it
+                "txt_bytes": len(txt_utf8) if txt_utf8 is not None else None,
             }
+        else:
+            st.info("Already converted in this session. Using cached result.")
+            st.session_state.results.move_to_end(file_hash)
+
+        md_text = st.session_state.results[file_hash]["md"]
+        original_bytes = st.session_state.results[file_hash]["original_bytes"]
 
         # --------------------------
         # Tabs: Result | File Size Comparison
@@ -257,16 +411,16 @@ for upload in uploads:
             out_md_name = build_output_name(upload.name, ".md")
             st.download_button(
                 label=f"⬇️ Download {out_md_name}",
-                data=(md_text or "").encode("utf-8"),
+                data=st.session_state.results[file_hash]["md_utf8"],
                 file_name=out_md_name,
                 mime="text/markdown",
                 use_container_width=True,
             )
-            if also_plain_text and st.session_state.results[file_hash].get("txt"):
+            if also_plain_text and st.session_state.results[file_hash].get("txt_utf8"):
                 out_txt_name = build_output_name(upload.name, ".txt")
                 st.download_button(
                     label=f"⬇️ Download {out_txt_name}",
-                    data=st.session_state.results[file_hash]["txt"].encode("utf-8"),
+                    data=st.session_state.results[file_hash]["txt_utf8"],
                     file_name=out_txt_name,
                     mime="text/plain",
                     use_container_width=True,
@@ -277,6 +431,14 @@ for upload in uploads:
                 st.markdown(md_text or "_(Nothing to render)_")
 
         with tab_sizes:
+            # st.tabs runs every tab's body on each rerun, so stripping only
+            # happens once the user asks; the result is memoized on the entry.
+            entry = st.session_state.results[file_hash]
+            if entry.get("txt_bytes") is None and not st.button("Compare sizes", key=f"sizes-{i}"):
+                st.caption("Computes the plain-text size of this conversion.")
+                continue
+            txt_bytes = ensure_txt_bytes(entry)
+
             # Two-row table + % smaller
             o_mb = human_mb(original_bytes)
             t_mb = human_mb(txt_bytes)
@@ -295,6 +457,26 @@ for upload in uploads:
             else:
                 st.info("Size comparison unavailable.")
 
+# Cap memory: evict least recently used results once everything is drawn, but
+# only files no longer in the uploader. Evicting a current upload would just
+# re-convert it on the next rerun and drop it from the summary and the ZIP.
+uploaded_now = {file_hash for _, _, file_hash, _ in jobs}
+for old_hash in list(st.session_state.results):
+    if len(st.session_state.results) <= max_results:
+        break
+    if old_hash not in uploaded_now:
+        del st.session_state.results[old_hash]
+
+# --------------------------
+# Session summary: sizes across all converted files
+# --------------------------
+if len(st.session_state.results) > 1:
+    st.divider()
+    st.subheader("Size Summary")
+    st.dataframe(size_summary(st.session_state.results), hide_index=True, use_container_width=True)
+    if any(item["txt_bytes"] is None for item in st.session_state.results.values()):
+        st.caption("Converted sizes appear once every file has been compared (or a ZIP has been prepared).")
+
 # --------------------------
 # Bundle: Download all as ZIP
 # --------------------------
@@ -302,22 +484,40 @@ if st.session_state.results:
     st.divider()
     if st.checkbox("Enable 'Download All as ZIP' (all converted files)", value=True):
         if st.button("⬇️ Prepare ZIP", use_container_width=True):
-            buf = io.BytesIO()
-            with zipfile.ZipFile(buf, "w", compression=zipfile.ZIP_DEFLATED) as zf:
-                for _, item in st.session_state.results.items():
-                    base = sanitize_filename(Path(item["name"]).stem)
-                    ts = datetime.now().strftime("%Y%m%d-%H%M%S")
-                    md_name = f"{base}__{ts}.md"
-                    zf.writestr(md_name, item["md"] or "")
-                    # include txt if we generated/stored it
-                    if item.get("txt"):
-                        txt_name = f"{base}__{ts}.txt"
-                        zf.writestr(txt_name, item["txt"] or "")
-            buf.seek(0)
-            st.download_button(
-                label="⬇️ Save ZIP",
-                data=buf,
-                file_name=f"converted_markdown_{datetime.now().strftime('%Y%m%d-%H%M%S')}.zip",
-                mime="application/zip",
-                use_container_width=True,
-            )
+            ts = timestamp()  # one stamp per bundle
+            used = set()
+            # Build on disk rather than in a BytesIO, so the archive is never
+            # held in memory alongside the copy Streamlit keeps for download.
+            with tempfile.NamedTemporaryFile(suffix=".zip", delete=False) as zip_tmp:
+                with zipfile.ZipFile(zip_tmp, "w", compression=zipfile.ZIP_DEFLATED, compresslevel=ZIP_LEVEL) as zf:
+                    for _, item in st.session_state.results.items():
+                        # Same stem, different content (e.g. two report.pdf): suffix -2, -3, …
+                        base, n = item["base"], 2
+                        while base in used:
+                            base, n = f"{item['base']}-{n}", n + 1
+                        used.add(base)
+                        md_name = f"{base}__{ts}.md"
+                        add_to_zip(zf, md_name, item["md_utf8"])
+                        # include txt if we generated/stored it
+                        if item.get("txt_utf8"):
+                            txt_name = f"{base}__{ts}.txt"
+                            add_to_zip(zf, txt_name, item["txt_utf8"])
+                    # The user asked for the full bundle, so size every file now
+                    # rather than shipping a summary with the .txt columns missing.
+                    for item in st.session_state.results.values():
+                        ensure_txt_bytes(item)
+                    add_to_zip(zf, f"size_summary__{ts}.csv", size_summary(st.session_state.results).to_csv(index=False))
+            try:
+                # download_button reads the file into Streamlit's media store
+                # immediately, so the temp copy can go right after.
+                with open(zip_tmp.name, "rb") as zip_file:
+                    st.download_button(
+                        label="⬇️ Save ZIP",
+                        data=zip_file,
+                        file_name=f"converted_markdown_{ts}.zip",
+                        mime="application/zip",
+                        use_container_width=True,
+                    )
+            finally:
+                try: os.remove(zip_tmp.name)
+                except OSError: pass